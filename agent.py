@@ -1,137 +1,342 @@
-import psycopg2
-from psycopg2 import errors
+import asyncpg
+import orjson
+import re
+import sqlglot
+from datetime import datetime
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
 from typing import TypedDict, Literal
 from langgraph.graph import StateGraph, END
 from langchain_core.messages import HumanMessage
-from mcp_setup import DB_CONFIG
-from groq_client import get_groq_llm, get_sql_validator_llm, get_conversational_llm
+from langchain_core.runnables import RunnableConfig
+from mcp_setup import get_db_pool
+from groq_client import get_combined_sql_llm, get_conversational_llm
 from logger_config import setup_logger
 
 logger = setup_logger("Agent_Orchestrator")
 
+# Built once per process so every turn reuses the same HTTP clients
+_GEN_CHAIN = get_combined_sql_llm()
+_CONV_LLM, _CONV_SYSTEM = get_conversational_llm()
+
 # --- 1. Define Agent State ---
 class AgentState(TypedDict):
     user_input: str
-    intent: Literal["read", "write", "unknown"]
+    user_text_lower: str
+    intent: Literal["read", "read_direct", "write", "unknown"]
+    specialty: str
     generated_sql: str
     is_valid: bool
     db_result: str
     final_response: str
+    response_ok: bool
+
+# --- 2. Execution Helpers ---
+WRITE_COMMANDS = ("INSERT", "UPDATE", "DELETE")
+MAX_READ_ROWS = 20
+
+def _starts_with_cmd(sql: str, cmds: tuple) -> bool:
+    # Only uppercases the first few characters instead of the whole statement
+    head = sql.lstrip()[:6].upper()
+    return head.startswith(cmds)
+
+def _naive_timestamp(value: str) -> datetime:
+    """Parses an ISO timestamp for a TIMESTAMP column. asyncpg can't encode aware values there, so they raise."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        raise ValueError(f"Timezone-aware timestamp: {value}")
+    return parsed
+
+# Parameterized templates for the query shapes the generator emits most often, with a
+# converter per parameter. asyncpg's statement cache prepares each one once per pooled
+# connection, so Postgres skips parse/plan on reuse.
+PREPARED_STATEMENTS = {
+    "find_doctors": (
+        "SELECT name, specialty, years_of_experience, consultation_fee FROM doctors WHERE specialty ILIKE $1",
+        (str,),
+    ),
+    "ins_appt": (
+        "INSERT INTO booked_appointments (patient_name, doctor_id, reason, appointment_time) "
+        "VALUES ($1, (SELECT id FROM doctors WHERE name ILIKE $2 LIMIT 1), $3, $4)",
+        (str, str, str, _naive_timestamp),
+    ),
+    "all_doctors": (
+        "SELECT name, specialty, years_of_experience, consultation_fee FROM doctors",
+        (),
+    ),
+    "upd_appt_time": (
+        "UPDATE booked_appointments SET appointment_time = $1 WHERE patient_name ILIKE $2",
+        (_naive_timestamp, str),
+    ),
+}
+
+def _query_shape(parsed, params: list = None):
+    """Normalized SQL with string literals (and $n parameters) replaced by placeholders.
 
-# --- 2. Execution Helper ---
-def execute_query_safe(sql: str, fetch: bool = True):
-    conn = None
+    Replaced literal values are appended to params in statement order.
+    """
+    def to_placeholder(node):
+        if isinstance(node, exp.Literal) and node.is_string and params is not None:
+            params.append(node.this)
+            return exp.Placeholder()
+        if isinstance(node, exp.Parameter):
+            return exp.Placeholder()
+        return node
+    return parsed.transform(to_placeholder).sql(dialect="postgres", normalize=True)
+
+_PREPARED_SHAPES = {
+    _query_shape(sqlglot.parse_one(template, read="postgres")): name
+    for name, (template, _) in PREPARED_STATEMENTS.items()
+}
+
+def match_prepared_statement(sql: str):
+    """Returns (template, params) if sql has the shape of a prepared statement, else None."""
+    try:
+        parsed = sqlglot.parse_one(sql, read="postgres")
+    except SqlglotError:
+        return None
+    params = []
+    name = _PREPARED_SHAPES.get(_query_shape(parsed, params))
+    if not name:
+        return None
+    template, converters = PREPARED_STATEMENTS[name]
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        cur.execute(sql)
-        if fetch:
-            res = str(cur.fetchall())
-            logger.info("READ operation successful.")
-            return res
+        # Values Postgres would coerce but asyncpg can't (e.g. odd date formats) use the raw SQL
+        return template, [convert(value) for convert, value in zip(converters, params)]
+    except ValueError:
+        return None
+
+def _rows_as_dicts(records):
+    """Rows keyed by column name. Repeated names (e.g. both id columns of a JOIN) become id, id_2, ...
+
+    dict(record) would keep only the last of each repeated column.
+    """
+    if not records:
+        return []
+    keys, used = [], set()
+    for name in records[0].keys():
+        key, n = name, 1
+        while key in used:
+            n += 1
+            key = f"{name}_{n}"
+        used.add(key)
+        keys.append(key)
+    return [dict(zip(keys, r.values())) for r in records]
+
+async def execute_query_safe(sql: str, fetch: bool = True, params: list = None):
+    try:
+        if params is None:
+            prepared = match_prepared_statement(sql)
+            query, params = prepared if prepared else (sql, [])
         else:
-            rows_affected = cur.rowcount
-            conn.commit()
-            logger.info(f"WRITE operation committed. Rows affected: {rows_affected}")
-            if rows_affected == 0 and "UPDATE" in sql.upper():
-                return "Error: Could not find an appointment for that user to update."
-            return "Success."
-    except errors.UniqueViolation:
-        if conn: conn.rollback()
+            query = sql
+        async with get_db_pool().acquire() as conn:
+            if fetch:
+                # A cursor only pulls the rows we keep (plus one to detect truncation);
+                # cursors need a transaction, which doubles as a read-only guard.
+                async with conn.transaction(readonly=True):
+                    cursor = await conn.cursor(query, *params)
+                    records = await cursor.fetch(MAX_READ_ROWS + 1)
+                # Compact JSON keyed by column name tokenizes far better than str() of tuples
+                res = orjson.dumps(_rows_as_dicts(records[:MAX_READ_ROWS]), default=str).decode()
+                if len(records) > MAX_READ_ROWS:
+                    res += f" (showing first {MAX_READ_ROWS} rows)"
+                logger.info("READ operation successful.")
+                return res
+            else:
+                status = await conn.execute(query, *params)
+                rows_affected = int(status.split()[-1]) if status.split()[-1].isdigit() else 0
+                logger.info(f"WRITE operation committed. Rows affected: {rows_affected}")
+                if rows_affected == 0 and _starts_with_cmd(sql, ("UPDATE",)):
+                    return "Error: Could not find an appointment for that user to update."
+                return "Success."
+    except asyncpg.UniqueViolationError:
         logger.warning("Double booking attempt blocked by database constraint.")
         return "Error: This day and time is already filled. Tell the user to book another slot."
-    except psycopg2.Error as e:
-        if conn: conn.rollback()
-        error_log = f"Postgres Error: {e.pgerror if hasattr(e, 'pgerror') else str(e)}"
+    except asyncpg.PostgresError as e:
+        error_log = f"Postgres Error: {str(e)}"
         logger.error(error_log)
         return error_log
     except Exception as e:
-        if conn: conn.rollback()
         logger.critical(f"Unexpected DB Failure: {str(e)}")
         return "System failure."
-    finally:
-        if conn: conn.close()
+
+# Mirrors the schema in the SQL generator prompt
+KNOWN_SCHEMA = {
+    "doctors": {"id", "name", "specialty", "years_of_experience", "consultation_fee"},
+    "booked_appointments": {"id", "patient_name", "doctor_id", "reason", "status", "created_at", "appointment_time"},
+}
+
+# Listed explicitly: Intersect/Except don't subclass Union, and the shared
+# SetOperation base only exists in newer sqlglot releases
+_SET_OPERATIONS = (exp.Union, exp.Intersect, exp.Except)
+
+def _parse_single(sql: str):
+    """Parses sql as exactly one SELECT/set operation/INSERT/UPDATE/DELETE statement, else returns None."""
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="postgres") if s is not None]
+    except SqlglotError:
+        return None
+    if len(statements) != 1 or not isinstance(statements[0], (exp.Select, *_SET_OPERATIONS, exp.Insert, exp.Update, exp.Delete)):
+        return None
+    return statements[0]
+
+def is_read_only(sql: str):
+    """True if sql is a single query (including CTEs and set operations) with no INSERT/UPDATE/DELETE anywhere in it."""
+    parsed = _parse_single(sql)
+    return parsed is not None and isinstance(parsed, (exp.Select, *_SET_OPERATIONS)) and not any(
+        parsed.find_all(exp.Insert, exp.Update, exp.Delete)
+    )
+
+def uses_known_schema(sql: str):
+    """Parses sql locally and returns True if it only references tables and columns in KNOWN_SCHEMA."""
+    parsed = _parse_single(sql)
+    if parsed is None:
+        return False
+
+    # CTE names are referenced like tables but are defined by the query itself
+    ctes = {cte.alias.lower() for cte in parsed.find_all(exp.CTE)}
+    tables = {t.name.lower() for t in parsed.find_all(exp.Table)} - ctes
+    if not tables or not tables <= KNOWN_SCHEMA.keys():
+        return False
+
+    allowed_columns = set().union(*(KNOWN_SCHEMA[t] for t in tables))
+    # Output aliases (e.g. ORDER BY fee after "consultation_fee AS fee") are also fair game
+    allowed_columns |= {a.alias.lower() for a in parsed.find_all(exp.Alias)}
+    columns = {c.name.lower() for c in parsed.find_all(exp.Column)}
+    # INSERT column lists are parsed as a Schema of identifiers, not Columns
+    for schema in parsed.find_all(exp.Schema):
+        columns.update(i.name.lower() for i in schema.expressions)
+    return columns <= allowed_columns
 
 # --- 3. Define Nodes ---
 
+# Substring match (not word-bounded) so "booking" or "patients" still count as writes
+WRITE_KEYWORDS = ["book", "appointment", "schedule", "edit", "change", "reschedule", "update", "patient", "time:", "reason:"]
+_WRITE_KEYWORDS_RE = re.compile("|".join(re.escape(k) for k in WRITE_KEYWORDS))
+
+# Plain doctor listings ("show all cardiologists") are answered without the SQL generator.
+# Stems are matched as ILIKE substrings of doctors.specialty, so each names one specialty.
+SPECIALTY_STEMS = ["cardio", "derma", "neurolog", "orthop", "pediatr", "paediatr", "gyn", "psychiatr", "oncolog", "ophthalm", "gastro", "endocrin", "urolog", "pulmon", "dentist"]
+_DIRECT_READ_VERBS = {"list", "show", "find", "which", "any"}
+_DIRECT_READ_FILLER = {"me", "us", "all", "the", "a", "an", "of", "your", "you", "are", "is", "there", "please", "do", "have", "can", "doctor", "doctors"}
+_WORD_RE = re.compile(r"\w+")
+
+def direct_read_specialty(user_text: str):
+    """Returns the specialty stem ("" for all doctors) if user_text is a plain doctor listing, else None.
+
+    Any word beyond a listing verb, filler, "doctor(s)" and a single specialty (a name,
+    a condition, a language, a number, a second specialty) means the fixed query can't
+    answer it, so None sends the turn to the SQL generator.
+    """
+    words = _WORD_RE.findall(user_text)
+    if not _DIRECT_READ_VERBS.intersection(words):
+        return None
+    stems = set()
+    for word in words:
+        if word in _DIRECT_READ_VERBS or word in _DIRECT_READ_FILLER:
+            continue
+        stem = next((stem for stem in SPECIALTY_STEMS if word.startswith(stem)), None)
+        if stem is None:
+            return None
+        stems.add(stem)
+    if len(stems) > 1 or not (stems or {"doctor", "doctors"}.intersection(words)):
+        return None
+    return stems.pop() if stems else ""
+
 def intent_classifier(state: AgentState):
     user_text = state["user_input"].lower()
+    specialty = ""
     
-    write_keywords = ["book", "appointment", "schedule", "edit", "change", "reschedule", "update", "patient", "time:", "reason:"]
-    
-    if any(k in user_text for k in write_keywords):
+    if _WRITE_KEYWORDS_RE.search(user_text):
         intent = "write"
     else:
-        intent = "read"
+        direct_specialty = direct_read_specialty(user_text)
+        if direct_specialty is not None:
+            intent = "read_direct"
+            specialty = direct_specialty
+        else:
+            intent = "read"
         
     logger.info(f"Classified intent: {intent}")
-    return {"intent": intent}
+    return {"intent": intent, "user_text_lower": user_text, "specialty": specialty}
 
-def sql_generator_node(state: AgentState):
+def classify_router(state: AgentState):
+    return "direct_read" if state["intent"] == "read_direct" else "generate"
+
+# Markdown code fences and any <think>...</think> reasoning the model emits around the SQL
+_FENCE_RE = re.compile(r"<think>.*?</think>|```(?:sql)?", re.S | re.I)
+
+async def sql_generator_node(state: AgentState):
     try:
         # If intent is write, check if we have the basics in the user_input
         # This prevents the LLM from hallucinating <placeholders>
         if state["intent"] == "write":
-            user_text = state["user_input"].lower()
+            user_text = state["user_text_lower"]
             # Simple check for Name, Time/Date, and Reason
             # You can make this more complex or use an LLM call
             if not any(word in user_text for word in ["at", "on", "2026", "pm", "am"]):
                  logger.info("Missing time info. Skipping SQL generation.")
                  return {"generated_sql": "MISSING_INFO", "is_valid": False}
 
-        llm, prompt = get_groq_llm()
-        response = (prompt | llm).invoke({"input": state["user_input"]})
-        sql = response.content.strip().replace("```sql", "").replace("```", "")
+        response = await _GEN_CHAIN.ainvoke({"input": state["user_input"]})
+        sql = _FENCE_RE.sub("", response.content).strip()
         logger.info(f"Generated SQL: {sql}")
-        return {"generated_sql": sql}
+
+        # The prompt already asks for schema-validated SQL; this is a cheap local sanity check
+        is_valid = uses_known_schema(sql)
+        if not is_valid:
+            logger.warning("Generated SQL references unknown tables or columns.")
+        return {"generated_sql": sql, "is_valid": is_valid}
     except Exception as e:
         logger.error(f"SQL Generation Node failed: {str(e)}")
         return {"generated_sql": "Error", "is_valid": False}
 
-def sql_validator_node(state: AgentState):
-    """New Node: Validates and fixes SQL before execution"""
-    try:
-        validator_chain = get_sql_validator_llm()
-        response = validator_chain.invoke({"sql": state["generated_sql"]})
-        validated_sql = response.content.strip().replace("```sql", "").replace("```", "")
-        
-        # Simple check: If the validator returns an empty string or non-SQL text
-        is_valid = any(keyword in validated_sql.upper() for keyword in ["SELECT", "INSERT", "UPDATE", "DELETE"])
-        
-        logger.info(f"SQL Validated. Corrected SQL: {validated_sql}")
-        return {"generated_sql": validated_sql, "is_valid": is_valid}
-    except Exception as e:
-        logger.error(f"SQL Validation Node failed: {str(e)}")
-        return {"is_valid": False}
-
-def write_executor_node(state: AgentState):
+async def write_executor_node(state: AgentState):
     sql = state["generated_sql"]
-    if not any(sql.upper().startswith(cmd) for cmd in ["INSERT", "UPDATE", "DELETE"]):
+    if not _starts_with_cmd(sql, WRITE_COMMANDS):
         logger.warning(f"Security Block: Non-Write query in WRITE node: {sql}")
         return {"db_result": "Unauthorized operation. Only writes are allowed here."}
-    return {"db_result": execute_query_safe(sql, fetch=False)}
+    return {"db_result": await execute_query_safe(sql, fetch=False)}
 
-def read_executor_node(state: AgentState):
+async def read_executor_node(state: AgentState):
     sql = state["generated_sql"]
-    if not sql.upper().startswith("SELECT"):
+    # CTEs and parenthesized UNIONs don't start with SELECT, so check those via the parser
+    if not (_starts_with_cmd(sql, ("SELECT",)) or (_starts_with_cmd(sql, ("WITH", "(")) and is_read_only(sql))):
         logger.warning(f"Security Block: Non-SELECT query in READ node: {sql}")
         return {"db_result": "Unauthorized operation."}
-    return {"db_result": execute_query_safe(sql, fetch=True)}
+    return {"db_result": await execute_query_safe(sql, fetch=True)}
+
+async def direct_read_node(state: AgentState):
+    """Lists doctors (optionally by specialty) with a fixed prepared query, skipping the SQL generator."""
+    if state["specialty"]:
+        sql, params = PREPARED_STATEMENTS["find_doctors"][0], [f"%{state['specialty']}%"]
+    else:
+        sql, params = PREPARED_STATEMENTS["all_doctors"][0], []
+    logger.info(f"Direct read for specialty: {state['specialty'] or 'all'}")
+    return {"generated_sql": sql, "is_valid": True, "db_result": await execute_query_safe(sql, fetch=True, params=params)}
 
-def response_generator_node(state: AgentState):
+async def response_generator_node(state: AgentState, config: RunnableConfig):
     try:
-        llm, system_msg = get_conversational_llm()
         if not state.get("is_valid", True):
             db_context = "The generated SQL was invalid and could not be executed."
         else:
             db_context = state['db_result']
 
         prompt = f"User: {state['user_input']}\nDatabase Result: {db_context}"
-        res = llm.invoke([system_msg, HumanMessage(content=prompt)])
-        return {"final_response": res.content}
+        # Streamed so the API can forward tokens to the client as they arrive. The node's
+        # config carries LangGraph's stream callbacks (contextvars don't on Python < 3.11).
+        final_response = ""
+        async for chunk in _CONV_LLM.astream([_CONV_SYSTEM, HumanMessage(content=prompt)], config=config):
+            final_response += chunk.content
+        if not final_response.strip():
+            # e.g. reasoning tokens used up the completion cap before any answer was emitted
+            logger.error("Final response node produced an empty reply.")
+            return {"final_response": "I apologize, but I encountered an internal error.", "response_ok": False}
+        return {"final_response": final_response, "response_ok": True}
     except Exception as e:
         logger.error(f"Final response node failed: {str(e)}")
-        return {"final_response": "I apologize, but I encountered an internal error."}
+        return {"final_response": "I apologize, but I encountered an internal error.", "response_ok": False}
 
 # --- 4. Build the Graph ---
 
@@ -140,17 +345,23 @@ workflow = StateGraph(AgentState)
 # Add all nodes
 workflow.add_node("classify", intent_classifier)
 workflow.add_node("generate", sql_generator_node)
-workflow.add_node("validate", sql_validator_node) 
+workflow.add_node("direct_read", direct_read_node)
 workflow.add_node("read", read_executor_node)
 workflow.add_node("write", write_executor_node)
 workflow.add_node("respond", response_generator_node)
 
-# Entry and linear flow to validation
+# Entry, then either the direct doctor listing or SQL generation
 workflow.set_entry_point("classify")
-workflow.add_edge("classify", "generate")
-workflow.add_edge("generate", "validate") 
+workflow.add_conditional_edges(
+    "classify",
+    classify_router,
+    {
+        "direct_read": "direct_read",
+        "generate": "generate"
+    }
+)
 
-# Conditional Router after Validation
+# Conditional Router after Generation
 def router(state: AgentState):
     # If the generator flagged missing info, go straight to the conversational responder
     if state.get("generated_sql") == "MISSING_INFO" or not state.get("is_valid", False):
@@ -160,7 +371,7 @@ def router(state: AgentState):
     return "read" if state["intent"] == "read" else "write"
 
 workflow.add_conditional_edges(
-    "validate", 
+    "generate", 
     router, 
     {
         "read": "read", 
@@ -169,11 +380,16 @@ workflow.add_conditional_edges(
     }
 )
 
+workflow.add_edge("direct_read", "respond")
 workflow.add_edge("read", "respond")
 workflow.add_edge("write", "respond")
 workflow.add_edge("respond", END)
 
-app = workflow.compile()
+# No checkpointer: each chat turn is a fresh, linear run, so there is no state to persist.
+app = workflow.compile(checkpointer=None)
+
+# The longest path is classify -> generate -> read/write -> respond
+GRAPH_CONFIG = {"recursion_limit": 10}
 
 if __name__ == "__main__":
     logger.info("--- Agent Session Started ---")
@@ -0,0 +1,26 @@
+import os
+from dataclasses import dataclass
+from dotenv import load_dotenv
+
+@dataclass(frozen=True)
+class Settings:
+    """Environment configuration, read once at import instead of on every call."""
+    groq_api_key: str
+    groq_model: str
+    db: dict
+
+def load_settings() -> Settings:
+    load_dotenv()
+    return Settings(
+        groq_api_key=os.getenv("GROQ_API_KEY"),
+        groq_model=os.getenv("GROQ_MODEL", "openai/gpt-oss-20b"),
+        db={
+            "host": os.getenv("DB_HOST", "localhost"),
+            "port": os.getenv("DB_PORT", "5432"),
+            "database": os.getenv("DB_NAME", "Agent"),
+            "user": os.getenv("DB_USER", "postgres"),
+            "password": os.getenv("DB_PASSWORD", "admin123"),
+        },
+    )
+
+settings = load_settings()
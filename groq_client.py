@@ -1,143 +1,120 @@
-import os
-from dotenv import load_dotenv
+from functools import lru_cache
 from langchain_groq import ChatGroq
 from langchain_core.messages import SystemMessage 
 from langchain_core.prompts import ChatPromptTemplate 
+from config import settings
 from logger_config import setup_logger
 
 # Initialize logger
 logger = setup_logger("Groq_Client")
-load_dotenv()
 
-def get_groq_llm():
+# Completion caps: keeps billing bounded and lets Groq schedule requests with a smaller budget.
+# On reasoning models (gpt-oss) reasoning tokens count against the cap too, so these leave
+# headroom over the visible output and reasoning effort is kept low (see reasoning_kwargs).
+SQL_MAX_TOKENS = 512
+CONVERSATIONAL_MAX_TOKENS = 1024
+
+def reasoning_kwargs(model: str) -> dict:
+    """Low reasoning effort for gpt-oss models; other Groq models reject the parameter."""
+    return {"reasoning_effort": "low"} if model.startswith("openai/gpt-oss") else {}
+
+# Static system prompts are frozen at import with no leading/trailing
+# whitespace and carry no per-request data, so the prefix sent to Groq is
+# byte-identical on every call and eligible for provider-side prompt caching.
+# Dynamic input only ever goes in the human turn.
+_SQL_SYS_PROMPT = """You are an SQL generator for a PostgreSQL database.
+CRITICAL RULES:
+- Return ONLY raw SQL
+- DO NOT include <think>, explanations, comments, or markdown
+- Output must start directly with SELECT / INSERT / UPDATE / DELETE
+- You MUST only use the tables and columns that exist in the schema below.
+- If the user mentions a category (e.g., cardiologists), do NOT invent a table.
+- Instead, filter the doctors table using WHERE specialty ILIKE '%<category>%'.
+
+DATABASE SCHEMA:
+TABLE doctors(
+    id SERIAL PRIMARY KEY,
+    name TEXT,
+    specialty TEXT,
+    years_of_experience INT,
+    consultation_fee INT
+);
+
+TABLE booked_appointments(
+    id SERIAL PRIMARY KEY,
+    patient_name VARCHAR(100) NOT NULL,
+    doctor_id INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    appointment_time TIMESTAMP NOT NULL,
+    FOREIGN KEY (doctor_id) REFERENCES doctors(id) ON DELETE CASCADE,
+    UNIQUE (doctor_id, appointment_time)
+);
+
+SPECIAL BEHAVIOR INSTRUCTIONS:
+1. BOOKING BY DOCTOR NAME: NEVER ask for a doctor_id. If a user provides a doctor's name, use a subquery to find their ID.
+   Example: INSERT INTO booked_appointments (patient_name, doctor_id, reason, appointment_time) VALUES ('John Doe', (SELECT id FROM doctors WHERE name ILIKE '%Smith%' LIMIT 1), 'Checkup', '2026-02-25 10:00:00');
+2. EDITING APPOINTMENTS: If a user wants to edit/change/reschedule an appointment, use an UPDATE statement.
+   Example: UPDATE booked_appointments SET appointment_time = '2026-02-26 14:00:00' WHERE patient_name ILIKE '%John Doe%';
+
+There is NO table named cardiologists, dermatologists, etc."""
+
+_COMBINED_SQL_SYS_PROMPT = _SQL_SYS_PROMPT + """
+
+SELF-VALIDATION BEFORE ANSWERING:
+1. Check that the SQL is valid PostgreSQL for the schema above.
+2. Ensure ONLY the tables and columns listed in the schema are used (subqueries using doctor name are allowed).
+3. If any wrong column or table would be used: FIX the SQL.
+4. NEVER change user intent. Allow SELECT, INSERT, UPDATE, and DELETE.
+5. Output ONLY the final, schema-validated SQL. No explanations."""
+
+@lru_cache(maxsize=None)
+def get_groq_llm(system_prompt: str = _SQL_SYS_PROMPT):
     """
-    Initialize and return the Groq LLM.
-    Uses the openai gpt-oss-20b model (fast and capable)
+    Initialize and return the Groq LLM chained to an SQL generator system prompt.
+    Uses the openai gpt-oss-20b model (fast and capable).
+    Cached per prompt so each ChatGroq HTTP client is built once per process.
     """
     try:
-        api_key = os.getenv("GROQ_API_KEY")
-        model = os.getenv("GROQ_MODEL", "openai/gpt-oss-20b")
+        api_key = settings.groq_api_key
+        model = settings.groq_model
 
         if not api_key:
             logger.error("GROQ_API_KEY not found in environment variables.")
             raise ValueError("GROQ_API_KEY not found in .env file")
 
-        system_message = SystemMessage(content="""
-        You are an SQL generator for a PostgreSQL database.
-        CRITICAL RULES:
-        - Return ONLY raw SQL
-        - DO NOT include <think>, explanations, comments, or markdown
-        - Output must start directly with SELECT / INSERT / UPDATE / DELETE                                      
-        - You MUST only use the tables and columns that exist in the schema below.
-        - If the user mentions a category (e.g., cardiologists), do NOT invent a table.
-        - Instead, filter the doctors table using WHERE specialty ILIKE '%<category>%'.
-
-        DATABASE SCHEMA:
-        TABLE doctors(
-            id SERIAL PRIMARY KEY,
-            name TEXT,
-            specialty TEXT,
-            years_of_experience INT,
-            consultation_fee INT
-        );
-
-        TABLE booked_appointments(
-            id SERIAL PRIMARY KEY,
-            patient_name VARCHAR(100) NOT NULL,
-            doctor_id INTEGER NOT NULL,
-            reason TEXT NOT NULL,
-            status VARCHAR(20) NOT NULL DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            appointment_time TIMESTAMP NOT NULL,
-            FOREIGN KEY (doctor_id) REFERENCES doctors(id) ON DELETE CASCADE,
-            UNIQUE (doctor_id, appointment_time)
-        );
-        
-        SPECIAL BEHAVIOR INSTRUCTIONS:
-        1. BOOKING BY DOCTOR NAME: NEVER ask for a doctor_id. If a user provides a doctor's name, use a subquery to find their ID.
-           Example: INSERT INTO booked_appointments (patient_name, doctor_id, reason, appointment_time) VALUES ('John Doe', (SELECT id FROM doctors WHERE name ILIKE '%Smith%' LIMIT 1), 'Checkup', '2026-02-25 10:00:00');
-        2. EDITING APPOINTMENTS: If a user wants to edit/change/reschedule an appointment, use an UPDATE statement.
-           Example: UPDATE booked_appointments SET appointment_time = '2026-02-26 14:00:00' WHERE patient_name ILIKE '%John Doe%';
-           
-        There is NO table named cardiologists, dermatologists, etc.
-        """)
-        
         base_llm = ChatGroq(
             api_key=api_key,
             model=model,
             temperature=0,  # Deterministic responses for SQL generation
-            max_tokens=2000
+            max_tokens=SQL_MAX_TOKENS,
+            **reasoning_kwargs(model)
         )
 
         prompt = ChatPromptTemplate.from_messages([
-            system_message,
+            SystemMessage(content=system_prompt),
             ("human", "{input}") 
         ])
         
         logger.info(f"Groq LLM (Generator) initialized successfully using model: {model}")
-        return base_llm, prompt
+        return prompt | base_llm
 
     except Exception as e:
         logger.error(f"Error initializing Groq LLM: {str(e)}")
         raise
 
-def get_sql_validator_llm():
-    """Initializes the SQL validator with error handling."""
-    try:
-        validator_prompt = ChatPromptTemplate.from_messages([
-            ("system", """
-        You are an expert PostgreSQL SQL validator. 
-        Your job is to:
-
-        1. Check if the SQL is valid for this schema.
-        2. Ensure ONLY these columns are used (Subqueries using doctor name are allowed):
-
-        TABLE doctors(
-            id,
-            name,
-            specialty,
-            years_of_experience,
-            consultation_fee
-        );
-
-        TABLE booked_appointments(
-            id,
-            patient_name,
-            doctor_id,
-            reason,
-            status,
-            created_at,
-            appointment_time
-        );
-
-        3. If any wrong column or table is found: FIX the SQL.
-        4. NEVER change user intent. Allow SELECT, INSERT, UPDATE, and DELETE.
-        5. ALWAYS return ONLY the corrected SQL. No explanations.
-
-        If SQL is valid, return it unchanged.
-    """),
-            ("human", "{sql}")
-        ])
-
-        llm = ChatGroq(
-            api_key=os.getenv("GROQ_API_KEY"),
-            model="openai/gpt-oss-20b",
-            temperature=0
-        )
-        
-        logger.info("SQL Validator LLM initialized successfully.")
-        return validator_prompt | llm
-
-    except Exception as e:
-        logger.error(f"Error initializing SQL Validator LLM: {str(e)}")
-        raise
+def get_combined_sql_llm():
+    """
+    SQL generator chain that also validates its own output against the schema,
+    so each turn needs a single Groq call instead of generate + validate.
+    """
+    return get_groq_llm(_COMBINED_SQL_SYS_PROMPT)
 
 def test_groq_connection():
     """Test basic Groq API connection"""
     try:
-        base_llm, prompt = get_groq_llm()
-        
-        final_chain = prompt | base_llm
+        final_chain = get_groq_llm()
         # Simple test message
         response = final_chain.invoke("Say 'Hello, I am working!' in one sentence.")
         
@@ -152,6 +129,7 @@ def test_groq_connection():
         logger.error(f"Groq API connection test failed: {str(e)}")
         return False
 
+@lru_cache(maxsize=1)
 def get_conversational_llm():
     """Initializes the conversational assistant with error handling."""
     try:
@@ -171,9 +149,11 @@ def get_conversational_llm():
 """)
         
         llm = ChatGroq(
-            api_key=os.getenv("GROQ_API_KEY"),
-            model=os.getenv("GROQ_MODEL", "openai/gpt-oss-20b"),
+            api_key=settings.groq_api_key,
+            model=settings.groq_model,
             temperature=0.3,
+            max_tokens=CONVERSATIONAL_MAX_TOKENS,
+            **reasoning_kwargs(settings.groq_model)
         )
 
         logger.info("Conversational LLM initialized successfully.")
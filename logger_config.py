@@ -1,24 +1,31 @@
+import atexit
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+if not os.path.exists("logs"):
+    os.makedirs("logs")
+
+# File handler (detailed), rotated so the log file never grows unbounded
+file_handler = RotatingFileHandler("logs/medconnect.log", maxBytes=10_000_000, backupCount=3)
+file_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+file_handler.setFormatter(file_format)
+
+# Console handler (scannable)
+console_handler = logging.StreamHandler()
+console_format = logging.Formatter('%(levelname)s: %(message)s')
+console_handler.setFormatter(console_format)
+
+# Loggers only enqueue records; a single background thread does the actual I/O
+log_queue = queue.Queue(-1)
+listener = QueueListener(log_queue, file_handler, console_handler)
+listener.start()
+atexit.register(listener.stop)
 
 def setup_logger(name):
-    if not os.path.exists("logs"):
-        os.makedirs("logs")
-    
     logger = logging.getLogger(name)
     if not logger.handlers:
         logger.setLevel(logging.INFO)
-        
-        # File handler (detailed)
-        file_handler = logging.FileHandler("logs/medconnect.log")
-        file_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(file_format)
-        
-        # Console handler (scannable)
-        console_handler = logging.StreamHandler()
-        console_format = logging.Formatter('%(levelname)s: %(message)s')
-        console_handler.setFormatter(console_format)
-        
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
-    return logger
\ No newline at end of file
+        logger.addHandler(QueueHandler(log_queue))
+    return logger
@@ -1,9 +1,13 @@
+import json
 import os
-from fastapi import FastAPI, HTTPException
+from cachetools import TTLCache
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Optional
-from agent import app as agent_graph  
+from agent import app as agent_graph, GRAPH_CONFIG
+from mcp_setup import init_db_pool, close_db_pool
 from logger_config import setup_logger
 
 logger = setup_logger("FastAPI_Backend")
@@ -23,43 +27,93 @@ class ChatRequest(BaseModel):
     user_input: str
     chat_history: Optional[List[dict]] = []
 
-# Data model for the response
-class ChatResponse(BaseModel):
-    final_response: str
-    intent: str
+# Exact-match cache of recent READ turns: normalized user input -> final response and intent.
+# Writes are never cached and clear the cache, since they can change what reads return.
+response_cache = TTLCache(maxsize=1024, ttl=60)
+# Bumped on every write so a read that overlapped a write doesn't store its stale result
+write_generation = 0
 
-@app.post("/chat", response_model=ChatResponse)
+def cache_key(user_input: str) -> str:
+    return " ".join(user_input.lower().split())
+
+def sse_frame(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+@app.post("/chat")
 async def chat_endpoint(request: ChatRequest):
     """
     Endpoint to interact with the LangGraph Healthcare Agent.
+    Streams Server-Sent Events: {"token": ...} frames while the final response is
+    generated, then one {"final_response": ..., "intent": ...} frame.
     """
-    try:
-        logger.info(f"Received request: {request.user_input}")
-        
-        # Invoke the LangGraph agent
-        # We pass the initial state required by your AgentState TypedDict
-        inputs = {
-            "messages": request.chat_history,
-            "user_input": request.user_input,
-            "intent": "unknown",
-            "generated_sql": "",
-            "is_valid": False,
-            "db_result": "",
-            "final_response": ""
-        }
-        
-        result = agent_graph.invoke(inputs)
-        
-        logger.info(f"Agent successfully processed request. Intent: {result['intent']}")
-        
-        return ChatResponse(
-            final_response=result["final_response"],
-            intent=result["intent"]
-        )
-
-    except Exception as e:
-        logger.error(f"Error in chat_endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
+    logger.info(f"Received request: {request.user_input}")
+
+    # We pass the initial state required by your AgentState TypedDict
+    inputs = {
+        "messages": request.chat_history,
+        "user_input": request.user_input,
+        "user_text_lower": "",
+        "intent": "unknown",
+        "specialty": "",
+        "generated_sql": "",
+        "is_valid": False,
+        "db_result": "",
+        "final_response": "",
+        "response_ok": False
+    }
+
+    key = cache_key(request.user_input)
+
+    async def event_stream():
+        global write_generation
+        cached = response_cache.get(key)
+        if cached is not None:
+            logger.info("Serving cached response for repeated read request.")
+            yield sse_frame({"final_response": cached["final_response"], "intent": cached["intent"]})
+            return
+
+        try:
+            generation = write_generation
+            result = inputs
+            # "messages" yields LLM tokens as they arrive, "values" the state after each step
+            async for mode, payload in agent_graph.astream(inputs, config=GRAPH_CONFIG, stream_mode=["messages", "values"]):
+                if mode == "messages":
+                    chunk, metadata = payload
+                    if metadata.get("langgraph_node") == "respond" and chunk.content:
+                        yield sse_frame({"token": chunk.content})
+                else:
+                    result = payload
+
+            logger.info(f"Agent successfully processed request. Intent: {result['intent']}")
+            # Successful reads serialize as a JSON array; DB errors, invalid SQL and failed
+            # replies (LLM errors, empty completions) are not cached
+            if result["intent"] == "write":
+                write_generation += 1
+                response_cache.clear()
+            elif (
+                result["intent"] in ("read", "read_direct")
+                and result["is_valid"]
+                and result["db_result"].startswith("[")
+                and result["response_ok"]
+                and result["final_response"]
+                and generation == write_generation
+            ):
+                response_cache[key] = {"final_response": result["final_response"], "intent": result["intent"]}
+            yield sse_frame({"final_response": result["final_response"], "intent": result["intent"]})
+
+        except Exception as e:
+            logger.error(f"Error in chat_endpoint: {str(e)}")
+            yield sse_frame({"error": "Internal Server Error"})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.on_event("startup")
+async def startup():
+    await init_db_pool()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_db_pool()
 
 @app.get("/health")
 async def health_check():
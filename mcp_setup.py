@@ -1,17 +1,37 @@
 import os
-from dotenv import load_dotenv
+import asyncpg
+from config import settings
 from logger_config import setup_logger
 
 logger = setup_logger("MCP_Setup")
-load_dotenv()
 
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST", "localhost"),
-    "port": os.getenv("DB_PORT", "5432"),
-    "database": os.getenv("DB_NAME", "Agent"),
-    "user": os.getenv("DB_USER", "postgres"),
-    "password": os.getenv("DB_PASSWORD", "admin123"),
-}
+DB_CONFIG = settings.db
+
+# Shared asyncpg pool so each query skips the connect/auth handshake.
+# Created by the FastAPI startup event since it needs a running event loop.
+_db_pool = None
+
+async def init_db_pool():
+    global _db_pool
+    _db_pool = await asyncpg.create_pool(
+        **{**DB_CONFIG, "port": int(DB_CONFIG["port"])},
+        min_size=1,
+        max_size=16,
+        statement_cache_size=100,
+    )
+    logger.info("Database connection pool created.")
+
+def get_db_pool():
+    if _db_pool is None:
+        raise RuntimeError("Database pool not initialized. Call init_db_pool() first.")
+    return _db_pool
+
+async def close_db_pool():
+    global _db_pool
+    if _db_pool is not None:
+        await _db_pool.close()
+        _db_pool = None
+        logger.info("Database connection pool closed.")
 
 def get_postgres_connection_string() -> str:
     """Generate PostgreSQL connection string for MCP server"""